@@ -2,6 +2,7 @@
 
 import os
 import re
+import functools
 import pandas as pd
 import pytz
 from netCDF4 import num2date
@@ -15,6 +16,15 @@ from ioos_qc.streams import XarrayStream
 from ioos_qc.results import collect_results
 from ioos_qc.utils import load_config_as_dict as loadconfig
 
+# glider deployment name formatted as glider-YYYYmmddTHHMM
+_GLIDER_RE = re.compile(r'^(.*)-(\d{8}T\d{4})')
+
+
+@functools.lru_cache(maxsize=1024)
+def _isdir_cached(path):
+    # directory existence checks are cached for a single run, the cache is cleared in find_glider_deployments_rootdir
+    return os.path.isdir(path)
+
 
 def convert_epoch_ts(data):
     if isinstance(data, xr.core.dataarray.DataArray):
@@ -27,9 +37,9 @@ def convert_epoch_ts(data):
     return time
 
 
-def find_glider_deployment_datapath(logger, deployment, deployments_root, dataset_type, cdm_data_type, mode):
-    glider_regex = re.compile(r'^(.*)-(\d{8}T\d{4})')
-    match = glider_regex.search(deployment)
+def find_glider_deployment_datapath(logger, deployment, deployments_root, dataset_type, cdm_data_type, mode,
+                                    existing=None):
+    match = _GLIDER_RE.search(deployment)
     if match:
         try:
             (glider, trajectory) = match.groups()
@@ -47,11 +57,18 @@ def find_glider_deployment_datapath(logger, deployment, deployments_root, datase
 
                 # Create fully-qualified path to the deployment location
                 deployment_location = os.path.join(deployments_root, deployment_name)
-                if os.path.isdir(deployment_location):
+                if existing is None:
+                    location_exists = _isdir_cached(deployment_location)
+                else:
+                    # look up the YYYY/glider-YYYYmmddTHHMM deployment name in the set of pre-scanned deployment
+                    # directories (see find_glider_deployments), and check the directory if it wasn't found in the scan
+                    location_exists = deployment_name in existing or _isdir_cached(deployment_location)
+
+                if location_exists:
                     # Set the deployment netcdf data path
                     data_path = os.path.join(deployment_location, 'data', 'out', 'nc',
                                              '{:s}-{:s}/{:s}'.format(dataset_type, cdm_data_type, mode))
-                    if not os.path.isdir(data_path):
+                    if not _isdir_cached(data_path):
                         logger.warning('{:s} data directory not found: {:s}'.format(trajectory, data_path))
                         data_path = None
                         deployment_location = None
@@ -72,8 +89,36 @@ def find_glider_deployment_datapath(logger, deployment, deployments_root, datase
     return data_path, deployment_location
 
 
+def find_glider_deployments(deployments_root, deployments):
+    # List the existing deployment directories in the year directories of the requested deployments, with a single
+    # scan of each year directory rather than checking for each deployment directory separately.
+    # Returns a set of deployment names formatted as YYYY/glider-YYYYmmddTHHMM
+    years = set()
+    for deployment in deployments:
+        match = _GLIDER_RE.search(deployment)
+        if match:
+            years.add(match.group(2)[:4])
+
+    existing = set()
+    for year in sorted(years):
+        try:
+            with os.scandir(os.path.join(deployments_root, year)) as year_deployments:
+                for d in year_deployments:
+                    if d.is_dir():
+                        existing.add(os.path.join(year, d.name))
+        except OSError:
+            # missing or unreadable year directory, deployments are checked individually in
+            # find_glider_deployment_datapath
+            continue
+
+    return existing
+
+
 def find_glider_deployments_rootdir(logger, test):
     # Find the glider deployments root directory
+    # this is called once at the start of each script, so start with a fresh directory cache
+    _isdir_cached.cache_clear()
+
     if test:
         envvar = 'GLIDER_DATA_HOME_TEST'
     else:
@@ -84,12 +129,12 @@ def find_glider_deployments_rootdir(logger, test):
     if not data_home:
         logger.error('{:s} not set'.format(envvar))
         return 1, 1
-    elif not os.path.isdir(data_home):
+    elif not _isdir_cached(data_home):
         logger.error('Invalid {:s}: {:s}'.format(envvar, data_home))
         return 1, 1
 
     deployments_root = os.path.join(data_home, 'deployments')
-    if not os.path.isdir(deployments_root):
+    if not _isdir_cached(deployments_root):
         logger.warning('Invalid deployments root: {:s}'.format(deployments_root))
         return 1, 1
 
@@ -196,17 +241,13 @@ def set_encoding(data_array, original_encoding=None):
     if original_encoding:
         data_array.encoding = original_encoding
 
-    try:
-        encoding_dtype = data_array.encoding['dtype']
-    except KeyError:
-        data_array.encoding['dtype'] = data_array.dtype
+    encoding = data_array.encoding
+    dtype = data_array.dtype
+    encoding.setdefault('dtype', dtype)
 
-    try:
-        encoding_fillvalue = data_array.encoding['_FillValue']
-    except KeyError:
+    if '_FillValue' not in encoding:
         # set the fill value using netCDF4.default_fillvals
-        data_type = f'{data_array.dtype.kind}{data_array.dtype.itemsize}'
-        data_array.encoding['_FillValue'] = default_fillvals[data_type]
+        encoding['_FillValue'] = default_fillvals[f'{dtype.kind}{dtype.itemsize}']
 
 
 def set_qartod_attrs(test, sensor, thresholds):
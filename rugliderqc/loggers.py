@@ -4,6 +4,7 @@ import os
 import pwd
 from datetime import datetime
 import logging
+from logging.handlers import QueueHandler
 
 
 def logfile_basename():
@@ -33,3 +34,15 @@ def setup_logger(name, loglevel, logfile):
         logger.addHandler(handler)
 
     return logger
+
+
+def setup_queue_logger(name, loglevel, log_queue):
+    # set up a logger in a worker process that sends log records to a queue, to be written to the log file by a
+    # QueueListener in the main process
+    logger = logging.getLogger(name)
+    logger.handlers = [QueueHandler(log_queue)]
+
+    log_level = getattr(logging, loglevel)
+    logger.setLevel(log_level)
+
+    return logger
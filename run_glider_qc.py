@@ -10,66 +10,68 @@ import argparse
 import sys
 import scripts
 
-arg_parser = argparse.ArgumentParser(description="QC RUCOOL's glider data",
-                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-arg_parser.add_argument('deployments',
-                        nargs='+',
-                        help='Glider deployment name(s) formatted as glider-YYYYmmddTHHMM')
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="QC RUCOOL's glider data",
+                                         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-arg_parser.add_argument('-m', '--mode',
-                        help='Deployment dataset status',
-                        choices=['rt', 'delayed'],
-                        default='rt')
+    arg_parser.add_argument('deployments',
+                            nargs='+',
+                            help='Glider deployment name(s) formatted as glider-YYYYmmddTHHMM')
 
-arg_parser.add_argument('--level',
-                        choices=['sci', 'ngdac'],
-                        default='sci',
-                        help='Dataset type')
+    arg_parser.add_argument('-m', '--mode',
+                            help='Deployment dataset status',
+                            choices=['rt', 'delayed'],
+                            default='rt')
 
-arg_parser.add_argument('-d', '--cdm_data_type',
-                        help='Dataset type',
-                        choices=['profile'],
-                        default='profile')
+    arg_parser.add_argument('--level',
+                            choices=['sci', 'ngdac'],
+                            default='sci',
+                            help='Dataset type')
 
-arg_parser.add_argument('-l', '--loglevel',
-                        help='Verbosity level',
-                        type=str,
-                        choices=['debug', 'info', 'warning', 'error', 'critical'],
-                        default='info')
+    arg_parser.add_argument('-d', '--cdm_data_type',
+                            help='Dataset type',
+                            choices=['profile'],
+                            default='profile')
 
-arg_parser.add_argument('-test', '--test',
-                        help='Point to the environment variable key GLIDER_DATA_HOME_TEST for testing.',
-                        action='store_true')
+    arg_parser.add_argument('-l', '--loglevel',
+                            help='Verbosity level',
+                            type=str,
+                            choices=['debug', 'info', 'warning', 'error', 'critical'],
+                            default='info')
 
-parsed_args = arg_parser.parse_args()
+    arg_parser.add_argument('-test', '--test',
+                            help='Point to the environment variable key GLIDER_DATA_HOME_TEST for testing.',
+                            action='store_true')
 
-# check for files that are missing CTD science variables
-scripts.check_science_variables.main(parsed_args)
+    parsed_args = arg_parser.parse_args()
 
-# check files that have duplicate timestamps
-scripts.check_duplicate_timestamps.main(parsed_args)
+    # check for files that are missing CTD science variables
+    scripts.check_science_variables.main(parsed_args)
 
-# apply QARTOD QC
-scripts.glider_qartod_qc.main(parsed_args)
+    # check files that have duplicate timestamps
+    scripts.check_duplicate_timestamps.main(parsed_args)
 
-# interpolate depth
-scripts.interpolate_depth.main(parsed_args)
+    # apply QARTOD QC
+    scripts.glider_qartod_qc.main(parsed_args)
 
-# check for severely-lagged CTD profile pairs
-scripts.ctd_hysteresis_test.main(parsed_args)
+    # interpolate depth
+    scripts.interpolate_depth.main(parsed_args)
 
-# summarize QARTOD flags
-scripts.summarize_qartod_flags.main(parsed_args)
+    # check for severely-lagged CTD profile pairs
+    scripts.ctd_hysteresis_test.main(parsed_args)
 
-# calculate optimal time shift for each segment for variables defined in config files (e.g. DO and pH voltages)
-# requires a deployment time_shift.yml config file in ./glider-deployment/config/qc to run
-scripts.time_shift.main(parsed_args)
+    # summarize QARTOD flags
+    scripts.summarize_qartod_flags.main(parsed_args)
 
-# calculate additional science variables (pH, TA, omega and dissolved oxygen in mg/L)
-scripts.add_derived_variables.main(parsed_args)
+    # calculate optimal time shift for each segment for variables defined in config files (e.g. DO and pH voltages)
+    # requires a deployment time_shift.yml config file in ./glider-deployment/config/qc to run
+    scripts.time_shift.main(parsed_args)
 
-# move the files to the parent directory to be sent to ERDDAP
-scripts.move_nc_files.main(parsed_args)
+    # calculate additional science variables (pH, TA, omega and dissolved oxygen in mg/L)
+    scripts.add_derived_variables.main(parsed_args)
 
-sys.exit()
+    # move the files to the parent directory to be sent to ERDDAP
+    scripts.move_nc_files.main(parsed_args)
+
+    sys.exit()
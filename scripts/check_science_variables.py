@@ -12,41 +12,123 @@ oxygen_concentration and optode_water_temperature are both 0.000.
 import os
 import argparse
 import sys
-import glob
-import xarray as xr
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from logging import getLogger
+from logging.handlers import QueueListener
+import netCDF4
+from netCDF4 import default_fillvals
 import numpy as np
 import rugliderqc.common as cf
-from rugliderqc.loggers import logfile_basename, setup_logger, logfile_deploymentname
+from rugliderqc.loggers import logfile_basename, setup_logger, logfile_deploymentname, setup_queue_logger
 from ioos_qc.utils import load_config_as_dict as loadconfig
 
 
-def check_zeros(varname_dict, dataset, ds_modified, var1, var2):
+def check_groups(varname_dict, var1, var2):
     """
-    Find indices where values for 2 variables are 0.0000 and convert all defined variables to fill values
+    Build the groups of variable names to check for 0.0000 values from a variable name config dictionary
     :param varname_dict: dictionary containing variables to modify if condition is met
-    :param dataset: xarray dataset
-    :param ds_modified: int value indicating if the dataset was modified
     :param var1: first variable name to test for condition (e.g. 'conductivity' or 'oxygen_concentration')
     :param var2: second variable name to test for condition (e.g. 'temperature' or 'optode_water_temperature')
-    returns int value indicating if the dataset was modified
+    returns list of tuples (var1 name, var2 name, list of variable names to modify)
     """
+    groups = []
     for key, variables in varname_dict.items():
-        try:
-            check_var1 = dataset[variables[var1]]
-            check_var2 = dataset[variables[var2]]
-        except KeyError:
+        if variables.get(var1) and variables.get(var2):
+            groups.append((variables[var1], variables[var2], list(variables.values())))
+
+    return groups
+
+
+def check_zeros(variable_groups, dataset, zeros):
+    """
+    Find indices where values for 2 variables are 0.0000, which identify where all defined variables should be
+    converted to fill values
+    :param variable_groups: list of tuples (var1 name, var2 name, list of variable names to modify), from check_groups
+    :param dataset: netCDF4 dataset
+    :param zeros: dictionary containing boolean arrays of the indices to convert to fill values, by variable name
+    returns dictionary containing boolean arrays of the indices to convert to fill values, by variable name
+    """
+    for check_var1, check_var2, varnames in variable_groups:
+        if check_var1 not in dataset.variables or check_var2 not in dataset.variables:
             continue
 
-        var1_zero_idx = np.where(check_var1 == 0.0000)[0]
-        if len(var1_zero_idx) > 0:
-            var2_zero_idx = np.where(check_var2 == 0.0000)[0]
-            dointersect_idx = np.intersect1d(var1_zero_idx, var2_zero_idx)
-            if len(dointersect_idx) > 0:
-                for cv, varname in variables.items():
-                    dataset[varname][dointersect_idx] = dataset[varname].encoding['_FillValue']
-                    ds_modified += 1
+        # find where both variables are 0.0 in a single pass, without building and intersecting index arrays
+        zero_mask = (dataset.variables[check_var1][:] == 0.0000) & (dataset.variables[check_var2][:] == 0.0000)
+        if zero_mask.any():
+            for varname in varnames:
+                if varname in zeros:
+                    zeros[varname] = zeros[varname] | zero_mask
+                else:
+                    zeros[varname] = zero_mask
 
-    return ds_modified
+    return zeros
+
+
+def process_file(ncfile, ctd_groups, oxygen_groups, sci_vars):
+    """
+    Check a file for science variables. If the file contains science variables, convert CTD and DO variables to fill
+    values where the two test variables are both 0.0000
+    :param ncfile: NetCDF file path
+    :param ctd_groups: groups of possible CTD variable names, from check_groups
+    :param oxygen_groups: groups of possible DO variable names, from check_groups
+    :param sci_vars: set of science variable names
+    returns 'bad' if the file can't be read, 'nosci' if the file doesn't contain science variables, 'modified' if
+    0.0000 values were converted to fill values, otherwise None
+    """
+    logging = getLogger('logging')
+    logging.debug(f'{ncfile}')
+
+    # Only the file header (variable names) is needed to check for science variables. The variables tested for 0.0
+    # values are read from the same open file, without decoding the dataset with xarray.
+    zeros = dict()
+    try:
+        with netCDF4.Dataset(ncfile) as nc:
+            # check for science variables
+            no_sci_vars = sci_vars.isdisjoint(nc.variables)
+
+            if not no_sci_vars:
+                nc.set_auto_mask(False)
+
+                # Find where CTD values should be fill values (conductivity and temperature both = 0.00)
+                # Try all versions of CTD variable names
+                zeros = check_zeros(ctd_groups, nc, zeros)
+
+                # Find where DO values should be fill values (oxygen_concentration and optode_water_temperature
+                # both = 0.00)
+                zeros = check_zeros(oxygen_groups, nc, zeros)
+
+                fill_values = dict()
+                for varname in zeros:
+                    data_type = f'{nc.variables[varname].dtype.kind}{nc.variables[varname].dtype.itemsize}'
+                    fill_values[varname] = getattr(nc.variables[varname], '_FillValue', default_fillvals[data_type])
+    except (OSError, ValueError) as e:
+        logging.error('Error reading file {:s} ({:})'.format(ncfile, e))
+        os.rename(ncfile, f'{ncfile}.bad')
+        return 'bad'
+
+    # files without science variables are renamed ".nosci" by main, after all files have been checked
+    if no_sci_vars:
+        logging.info('Science variables not found in file: {:s}'.format(ncfile))
+        return 'nosci'
+
+    if len(zeros) == 0:
+        return None
+
+    # only write the fill values to the file, rather than rewriting the entire file. The values spanning the
+    # modified indices are updated as a numpy array and written back in one contiguous slice, rather than
+    # writing to the file variable at each index.
+    with netCDF4.Dataset(ncfile, 'r+') as nc:
+        nc.set_auto_mask(False)
+        for varname, zero_mask in zeros.items():
+            zero_idx = np.flatnonzero(zero_mask)
+            span = slice(zero_idx[0], zero_idx[-1] + 1)
+            values = nc.variables[varname][span]
+            values[zero_mask[span]] = fill_values[varname]
+            nc.variables[varname][span] = values
+
+    return 'modified'
 
 
 def main(args):
@@ -70,10 +152,41 @@ def main(args):
             logging_base.warning('Invalid QC config root: {:s}'.format(qc_config_root))
             return 1
 
+        # Get all of the possible CTD variable names from the config file (loaded once for all deployments)
+        ctd_config_file = os.path.join(qc_config_root, 'ctd_variables.yml')
+        if not os.path.isfile(ctd_config_file):
+            logging_base.error('Invalid CTD variable name config file: {:s}.'.format(ctd_config_file))
+            return 1
+
+        ctd_vars = loadconfig(ctd_config_file)
+        ctd_groups = check_groups(ctd_vars, 'conductivity', 'temperature')
+
+        # Get dissolved oxygen variable names
+        oxygen_config_file = os.path.join(qc_config_root, 'oxygen_variables.yml')
+        if not os.path.isfile(oxygen_config_file):
+            logging_base.error('Invalid DO variable name config file: {:s}.'.format(oxygen_config_file))
+            return 1
+
+        oxygen_vars = loadconfig(oxygen_config_file)
+        oxygen_groups = check_groups(oxygen_vars, 'oxygen_concentration', 'optode_water_temperature')
+
+        # Get list of science variables
+        science_variables = os.path.join(qc_config_root, 'science_variables.txt')
+        if not os.path.isfile(science_variables):
+            logging_base.error('Invalid science variables config file: {:s}.'.format(science_variables))
+            return 1
+
+        with open(science_variables, 'r') as sv:
+            sci_vars = frozenset(sv.read().split('\n'))
+
+        # List the existing deployment directories in the years of the requested deployments once for all deployments
+        existing_deployments = cf.find_glider_deployments(deployments_root, args.deployments)
+
         for deployment in args.deployments:
 
             data_path, deployment_location = cf.find_glider_deployment_datapath(logging_base, deployment, deployments_root,
-                                                                                dataset_type, cdm_data_type, mode)
+                                                                                dataset_type, cdm_data_type, mode,
+                                                                                existing=existing_deployments)
 
             if not data_path:
                 logging_base.error('{:s} data directory not found:'.format(deployment))
@@ -107,81 +220,47 @@ def main(args):
 
             logging.info('Checking for science variables: {:s}'.format(os.path.join(data_path, 'qc_queue')))
 
-            # Get all of the possible CTD variable names from the config file
-            ctd_config_file = os.path.join(qc_config_root, 'ctd_variables.yml')
-            if not os.path.isfile(ctd_config_file):
-                logging.error('Invalid CTD variable name config file: {:s}.'.format(ctd_config_file))
-                status = 1
-                continue
-
-            ctd_vars = loadconfig(ctd_config_file)
-
-            # Get dissolved oxygen variable names
-            oxygen_config_file = os.path.join(qc_config_root, 'oxygen_variables.yml')
-            if not os.path.isfile(oxygen_config_file):
-                logging.error('Invalid DO variable name config file: {:s}.'.format(oxygen_config_file))
-                status = 1
-                continue
-
-            oxygen_vars = loadconfig(oxygen_config_file)
-
-            # Get list of science variables
-            science_variables = os.path.join(qc_config_root, 'science_variables.txt')
-            if not os.path.isfile(science_variables):
-                logging.error('Invalid science variables config file: {:s}.'.format(science_variables))
-                status = 1
-                continue
-
-            sci_vars = open(science_variables, 'r').read().split('\n')
-
             # List the netcdf files in qc_queue
-            ncfiles = sorted(glob.glob(os.path.join(data_path, 'qc_queue', '*.nc')))
+            try:
+                with os.scandir(os.path.join(data_path, 'qc_queue')) as entries:
+                    inodes = {e.path: e.inode() for e in entries if e.name.endswith('.nc') and e.is_file()}
+            except FileNotFoundError:
+                inodes = dict()
+
+            ncfiles = sorted(inodes)
 
             if len(ncfiles) == 0:
                 logging.error(' 0 files found to check: {:s}'.format(os.path.join(data_path, 'qc_queue')))
                 status = 1
                 continue
 
-            # Iterate through files, check for science variables, and check for values of 0.0
-            summary = 0
-            zeros_removed = 0
-            for f in ncfiles:
-                logging.debug(f'{f}')
-                modified = 0
-                try:
-                    with xr.open_dataset(f, decode_times=False) as ds:
-                        ds = ds.load()
-                except OSError as e:
-                    logging.error('Error reading file {:s} ({:})'.format(f, e))
-                    os.rename(f, f'{f}.bad')
-                    status = 1
-                    continue
-                except ValueError as e:
-                    logging.error('Error reading file {:s} ({:})'.format(f, e))
-                    os.rename(f, f'{f}.bad')
-                    status = 1
-                    continue
-
-                # check for science variables
-                ds_sci_vars = list(set(ds.data_vars).intersection(set(sci_vars)))
-
-                if len(ds_sci_vars) == 0:
-                    os.rename(f, f'{f}.nosci')
-                    logging.info('Science variables not found in file: {:s}'.format(f))
-                    summary += 1
-                else:
-                    # Set CTD values to fill values where conductivity and temperature both = 0.00
-                    # Try all versions of CTD variable names
-                    modified = check_zeros(ctd_vars, ds, modified, 'conductivity', 'temperature')
-
-                    # Set DO values to fill values where oxygen_concentration and oxygen_saturation both = 0.00
-                    modified = check_zeros(oxygen_vars, ds, modified, 'oxygen_concentration', 'optode_water_temperature')
-
-                ds.to_netcdf(f)
-
-                # if zeros were removed from the ds, add to the log
-                if modified > 0:
-                    zeros_removed += 1
+            # Iterate through files, check for science variables, and check for values of 0.0. Each file is checked
+            # independently, so the files are processed in parallel. Log records from the worker processes are
+            # passed back to the deployment log file through a queue.
+            log_queue = multiprocessing.Queue()
+            listener = QueueListener(log_queue, *logging.handlers)
+            listener.start()
+            worker = partial(process_file, ctd_groups=ctd_groups, oxygen_groups=oxygen_groups, sci_vars=sci_vars)
+            try:
+                with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=setup_queue_logger,
+                                         initargs=('logging', loglevel, log_queue)) as executor:
+                    results = list(executor.map(worker, ncfiles, chunksize=32))
+            finally:
+                # stop the listener thread and close the log queue even if a worker raises an exception
+                listener.stop()
+                log_queue.close()
+                log_queue.join_thread()
+
+            # Rename the files without science variables in inode order, which keeps the directory entry updates
+            # close together on disk for large directories
+            nosci_files = [f for f, result in zip(ncfiles, results) if result == 'nosci']
+            for f in sorted(nosci_files, key=inodes.get):
+                os.rename(f, f'{f}.nosci')
+
+            if 'bad' in results:
+                status = 1
+            summary = results.count('nosci')
+            zeros_removed = results.count('modified')
 
             logging.info('Found {:} files without science variables (of {:} total files)'.format(summary, len(ncfiles)))
             logging.info('Removed 0.00 values (TWRC fill values) for CTD and/or DO variables in {:} files (of {:} '
@@ -10,16 +10,20 @@ import os
 import argparse
 import sys
 import datetime as dt
-import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from logging import getLogger
+from logging.handlers import QueueListener
+import netCDF4
 import numpy as np
 import xarray as xr
-import pandas as pd
 from shapely.geometry import Polygon, MultiPolygon
 from shapely.ops import polygonize
 from ioos_qc import qartod
 from ioos_qc.utils import load_config_as_dict as loadconfig
 import rugliderqc.common as cf
-from rugliderqc.loggers import logfile_basename, setup_logger, logfile_deploymentname
+from rugliderqc.loggers import logfile_basename, setup_logger, logfile_deploymentname, setup_queue_logger
 np.set_printoptions(suppress=True)
 
 
@@ -35,33 +39,54 @@ def append_ancillary_variables(data_array, qc_variable_name):
         data_array.attrs['ancillary_variables'] = ' '.join((data_array.ancillary_variables, qc_variable_name))
 
 
-def apply_qartod_qc(dataset, varname):
+def apply_qartod_qc(dataset, varname, qartod_varnames):
     """
     Make a copy of a data array and convert values with not_evaluated (2) suspect (3) and fail (4) QC flags to nans
     :param dataset: xarray dataset
     :param varname: sensor variable name (e.g. conductivity)
+    :param qartod_varnames: list of the QARTOD QC variable names for the sensor, from find_qartod_variables
+    returns numpy array
     """
-    datacopy = dataset[varname].copy()
-    for qv in [x for x in dataset.data_vars if f'{varname}_qartod' in x]:
+    # combine the flags from all of the QARTOD tests into one mask, and apply it in a single pass. Flag values are
+    # whole numbers (or nan where the flag variable has fill values), so 2 <= flag <= 4 is the same as checking for
+    # each flag value
+    qc_mask = np.zeros(dataset[varname].shape, dtype=bool)
+    for qv in qartod_varnames:
         qv_vals = dataset[qv].values
-        qv_idx = np.where(np.logical_or(np.logical_or(qv_vals == 2, qv_vals == 3), qv_vals == 4))[0]
-        datacopy[qv_idx] = np.nan
-    return datacopy
+        qc_mask |= (qv_vals >= 2) & (qv_vals <= 4)
+    return np.where(qc_mask, np.nan, dataset[varname].values)
 
 
-def initialize_flags(dataset, varname):
-    # start with flag values NOT_EVALUATED/UNKNOWN (2)
-    flags = 2 * np.ones(np.shape(dataset[varname].values))
+def find_qartod_variables(dataset, varnames):
+    """
+    Find the QARTOD QC variables for each sensor variable in a dataset
+    :param dataset: xarray dataset
+    :param varnames: list of sensor variable names (e.g. ['pressure', 'conductivity', 'temperature'])
+    returns dictionary containing the list of QARTOD QC variable names for each sensor variable
+    """
+    return {varname: [x for x in dataset.data_vars if f'{varname}_qartod' in x] for varname in varnames}
+
+
+def initialize_flags_all(dataset, varnames):
+    """
+    Initialize the flag arrays for all of the test variables in a dataset. The variables are checked for nans
+    together, and the flags for each variable are stored as one row of a single flag array.
+    :param dataset: xarray dataset
+    :param varnames: list of sensor variable names (e.g. ['conductivity', 'temperature'])
+    returns dictionary containing a tuple (boolean array of non-nans, flag array) for each variable in the dataset
+    """
+    varnames = [v for v in varnames if v in dataset]
+    if len(varnames) == 0:
+        return dict()
 
-    # identify where not nan
-    non_nan_ind = np.invert(np.isnan(dataset[varname].values))
-    # get locations of non-nans
-    non_nan_i = np.where(non_nan_ind)[0]
+    # identify where nan
+    nan_ind = np.isnan(np.stack([dataset[v].values for v in varnames]))
 
-    # flag the missing values
-    flags[np.invert(non_nan_ind)] = qartod.QartodFlags.MISSING
+    # start with flag values NOT_EVALUATED/UNKNOWN (2), and flag the missing values
+    flags = np.full(nan_ind.shape, 2, dtype=np.int8)
+    flags[nan_ind] = qartod.QartodFlags.MISSING
 
-    return non_nan_i, flags
+    return {v: (~nan_ind[i], flags[i]) for i, v in enumerate(varnames)}
 
 
 def add_da(dataset, flag_array, attributes, test_varname, qc_variable_name):
@@ -82,6 +107,417 @@ def add_da(dataset, flag_array, attributes, test_varname, qc_variable_name):
     dataset[qc_variable_name] = da
 
 
+def interpolate_gaps(values, limit):
+    """
+    Linearly interpolate nans that are within a number of points of a valid value (in either direction), the same as
+    pandas.Series.interpolate(method='linear', limit_direction='both', limit=limit)
+    :param values: numpy array
+    :param limit: maximum number of consecutive nans to fill from a valid value
+    """
+    isnan = np.isnan(values)
+    if not isnan.any() or isnan.all():
+        return values
+
+    idx = np.arange(len(values))
+    valid = np.flatnonzero(~isnan)
+
+    # index of the previous and next valid values for each point
+    prev_valid = np.maximum.accumulate(np.where(isnan, -1, idx))
+    next_valid = np.minimum.accumulate(np.where(isnan, len(values), idx)[::-1])[::-1]
+    fill = isnan & (((prev_valid >= 0) & (idx - prev_valid <= limit)) |
+                    ((next_valid < len(values)) & (next_valid - idx <= limit)))
+
+    filled = values.copy()
+    filled[fill] = np.interp(idx[fill], valid, values[valid])
+
+    return filled
+
+
+def profile_pair_area(x, y):
+    """
+    Calculate the area enclosed by a profile pair, where the points of the down profile followed by the up profile
+    form a closed polygon. The profiles can cross over each other (including at points sampled by both profiles), so
+    the polygon outline is split into separate polygons at each crossover and the areas of the polygons are summed.
+    :param x: numpy array of x values for the profile pair (e.g. pressure)
+    :param y: numpy array of y values for the profile pair (e.g. conductivity)
+    """
+    polygon_points = np.column_stack((np.append(x, x[0]), np.append(y, y[0])))
+    polygon = Polygon(polygon_points)
+    polygon_lines = polygon.exterior
+    polygon_crossovers = polygon_lines.intersection(polygon_lines)
+    polygons = polygonize(polygon_crossovers)
+    valid_polygons = MultiPolygon(polygons)
+
+    return valid_polygons.area
+
+
+def hysteresis_flag(pressure, data, thresholds):
+    """
+    Determine the hysteresis flag for a down/up profile pair
+    :param pressure: numpy array of QC'd pressure for the down profile followed by the up profile, with no nans
+    :param data: numpy array of QC'd sensor data (e.g. conductivity) matching the pressure array, with no nans
+    :param thresholds: flag thresholds from QC configuration file (test_threshold, suspect_threshold, fail_threshold)
+    returns the QARTOD flag for both profiles in the pair
+    """
+    # calculate data ranges (the arrays don't contain nans, so a single pass with np.ptp is used for each range)
+    pressure_range = np.ptp(pressure)  # 'QCd pressure'
+    data_range = np.ptp(data)
+
+    # if data range is < test_threshold, the profiles are good since there will be no measureable hysteresis
+    # (usually in well-mixed water)
+    if data_range <= thresholds['test_threshold']:
+        return qartod.QartodFlags.GOOD
+
+    # normalize area between the profiles to the pressure range
+    area = profile_pair_area(pressure, data) / pressure_range
+
+    if area > data_range * thresholds['fail_threshold']:
+        return qartod.QartodFlags.FAIL
+    elif area > data_range * thresholds['suspect_threshold']:
+        return qartod.QartodFlags.SUSPECT
+    else:
+        return qartod.QartodFlags.GOOD
+
+
+def load_test_variables(ncfile, test_varnames):
+    """
+    Load only the variables used by the test from a NetCDF file: pressure, the test variables, salinity and density,
+    and the QARTOD QC variables for pressure and the test variables
+    :param ncfile: NetCDF file path
+    :param test_varnames: list of sensor variable names to test (e.g. ['conductivity', 'temperature'])
+    returns xarray dataset
+    """
+    varnames = ['pressure', 'salinity', 'density'] + test_varnames
+    qartod_prefixes = [f'{v}_qartod' for v in ['pressure'] + test_varnames]
+    with xr.open_dataset(ncfile, engine='netcdf4', decode_times=False) as ds:
+        keep = [v for v in ds.data_vars if v in varnames or any(x in v for x in qartod_prefixes)]
+        ds = ds[keep].load()
+
+    return ds
+
+
+def save_ds(dataset, ncfile, test_varnames):
+    """
+    Append the hysteresis test variables to the original file, and update the ancillary_variables attributes and the
+    history attribute. Only the flag values and attributes are written, the other variables in the file are left as-is.
+    :param dataset: xarray dataset from load_test_variables, with the hysteresis test results added
+    :param ncfile: NetCDF file path
+    :param test_varnames: list of sensor variable names to test (e.g. ['conductivity', 'temperature'])
+    """
+    with netCDF4.Dataset(ncfile, 'a') as nc:
+        for testvar in test_varnames:
+            qc_varname = f'{testvar}_hysteresis_test'
+            if qc_varname not in dataset:
+                continue
+
+            da = dataset[qc_varname]
+            if qc_varname in nc.variables:
+                qc_var = nc.variables[qc_varname]
+            else:
+                qc_var = nc.createVariable(qc_varname, da.encoding['dtype'], da.dims,
+                                           fill_value=da.encoding['_FillValue'])
+            qc_var[:] = da.values
+            qc_var.setncatts(da.attrs)
+
+        for v in test_varnames + ['salinity', 'density']:
+            if v in dataset and 'ancillary_variables' in dataset[v].attrs:
+                nc.variables[v].ancillary_variables = dataset[v].attrs['ancillary_variables']
+
+        nc.history = dataset.attrs['history']
+
+
+def profile_info(ncfile, test_varnames):
+    """
+    Get the information needed to pair a file with the next file, without running the test
+    :param ncfile: NetCDF file path
+    :param test_varnames: list of sensor variable names to test (e.g. ['conductivity', 'temperature'])
+    returns None if the file can't be read, otherwise a dictionary containing the test variables in the file, the test
+    variables with data, whether the file contains pressure, and the first and last QC'd pressure values (None if the
+    file doesn't contain pressure or the profile spans <5 dbar)
+    """
+    logging = getLogger('logging')
+    try:
+        # each variable is only read once, so the arrays aren't cached by xarray
+        with xr.open_dataset(ncfile, engine='netcdf4', decode_times=False, cache=False) as ds:
+            info = dict()
+            info['testvars'] = {tv for tv in test_varnames if tv in ds}
+            info['data_testvars'] = {tv for tv in info['testvars'] if np.sum(~np.isnan(ds[tv].values)) > 0}
+            info['has_pressure'] = 'pressure' in ds
+
+            # if the file doesn't contain pressure, the test isn't run
+            if not info['has_pressure']:
+                logging.debug('pressure not found in file {:s})'.format(ncfile))
+                info['pressure_ends'] = None
+                return info
+
+            # apply qartod QC to pressure
+            qartod_vars = find_qartod_variables(ds, ['pressure'])
+            pressure_copy = apply_qartod_qc(ds, 'pressure', qartod_vars['pressure'])
+    except OSError as e:
+        logging.error('Error reading file {:s} ({:})'.format(ncfile, e))
+        return None
+
+    # if the pressure values are all nan or profile spans <5 dbar, the test isn't run
+    pressure_diff = np.nanmax(pressure_copy) - np.nanmin(pressure_copy)
+    if np.logical_or(np.isnan(pressure_diff), pressure_diff < 5):
+        info['pressure_ends'] = None
+    else:
+        pressure_non_nan = pressure_copy[~np.isnan(pressure_copy)]
+        info['pressure_ends'] = (pressure_non_nan[0], pressure_non_nan[-1])
+
+    return info
+
+
+def find_profile_pairs(ncfiles, profiles):
+    """
+    Pair each down profile with the following up profile. A file is paired with the next file if the first profile is
+    down, the second file contains pressure and the second profile isn't down, and the second file contains one of the
+    test variables with data in the first file. Files that can't be read are skipped.
+    :param ncfiles: list of NetCDF file paths, sorted by time
+    :param profiles: list of dictionaries from profile_info for each file (None if the file can't be read)
+    returns list of tuples (file path, first and last QC'd pressure values, next file path, test variables in the next
+    file, True if the file is paired with the next file), the next file path and test variables are None for the last
+    file
+    """
+    readable = [(f, info) for f, info in zip(ncfiles, profiles) if info is not None]
+    ncfiles = [f for f, info in readable]
+    profiles = [info for f, info in readable]
+
+    pairs = []
+    i = 0
+    while i < len(ncfiles):
+        info = profiles[i]
+        if i + 1 == len(ncfiles):
+            pairs.append((ncfiles[i], info['pressure_ends'], None, None, False))
+            break
+
+        info2 = profiles[i + 1]
+        first_down = info['pressure_ends'] is not None and info['pressure_ends'][0] <= info['pressure_ends'][1]
+        second_down = info2['pressure_ends'] is not None and info2['pressure_ends'][0] < info2['pressure_ends'][1]
+        shared_testvars = not info['data_testvars'].isdisjoint(info2['testvars'])
+        if first_down and info2['has_pressure'] and not second_down and shared_testvars:
+            pairs.append((ncfiles[i], info['pressure_ends'], ncfiles[i + 1], info2['testvars'], True))
+            i += 2
+        else:
+            pairs.append((ncfiles[i], info['pressure_ends'], ncfiles[i + 1], info2['testvars'], False))
+            i += 1
+
+    return pairs
+
+
+def process_pair(ncfile, pressure_ends, next_file, next_testvars, paired, test_settings, test_varnames):
+    """
+    Run the hysteresis test on a file and the file it is paired with, and save the results to the file(s)
+    :param ncfile: NetCDF file path
+    :param pressure_ends: first and last QC'd pressure values of ncfile, or None if the profile spans <5 dbar (from
+    profile_info)
+    :param next_file: path of the NetCDF file following ncfile, or None if ncfile is the last file
+    :param next_testvars: test variables in the next file, or None if ncfile is the last file
+    :param paired: True if ncfile is paired with the next file (from find_profile_pairs)
+    :param test_settings: dictionary containing the test thresholds, QC variable name and QC variable attributes for
+    each test variable
+    :param test_varnames: list of sensor variable names to test (e.g. ['conductivity', 'temperature'])
+    returns status and a summary dictionary containing the number of not evaluated, suspect and failed profiles for
+    each test variable
+    """
+    logging = getLogger('logging')
+    status = 0
+
+    summary = dict()
+    for tv in test_varnames:
+        summary[tv] = dict()
+        summary[tv]['failed_profiles'] = 0
+        summary[tv]['suspect_profiles'] = 0
+        summary[tv]['not_evaluated_profiles'] = 0
+
+    try:
+        ds = load_test_variables(ncfile, test_varnames)
+    except OSError as e:
+        logging.error('Error reading file {:s} ({:})'.format(ncfile, e))
+        return 1, summary
+
+    # the second file is only opened if it is paired with the first file (otherwise it is tested with the file
+    # after it)
+    ds2 = None
+    if paired:
+        try:
+            ds2 = load_test_variables(next_file, test_varnames)
+        except OSError as e:
+            logging.error('Error reading file {:s} ({:})'.format(next_file, e))
+            status = 1
+            ds2 = None
+
+    # initialize the flags for all of the test variables at once, and find the QARTOD QC variables
+    flags = initialize_flags_all(ds, test_varnames)
+    qartod_vars = find_qartod_variables(ds, ['pressure'] + test_varnames)
+    if ds2 is not None:
+        flags2 = initialize_flags_all(ds2, test_varnames)
+        qartod_vars2 = find_qartod_variables(ds2, ['pressure'] + test_varnames)
+
+    # the QC'd pressure and time arrays are the same for all of the test variables, so they're extracted once. The
+    # profile direction is already known (from profile_info), so they're only needed if the files are paired.
+    if ds2 is not None:
+        pressure_copy = apply_qartod_qc(ds, 'pressure', qartod_vars['pressure'])
+        pressure_copy2 = apply_qartod_qc(ds2, 'pressure', qartod_vars2['pressure'])
+        pressure_diff2 = np.nanmax(pressure_copy2) - np.nanmin(pressure_copy2)
+        ds_time = cf.convert_epoch_ts(ds['time'])
+        ds2_time = cf.convert_epoch_ts(ds2['time'])
+
+        # interpolate pressure (in the case where pressure and sci data are offset)
+        pressure_interp = interpolate_gaps(pressure_copy, limit=2)
+        pressure_interp2 = interpolate_gaps(pressure_copy2, limit=2)
+        pair_pressure = np.concatenate([pressure_interp, pressure_interp2])
+
+    # Iterate through the test variables
+    for testvar in test_varnames:
+        # get the configuration thresholds, QC variable name and attributes
+        hysteresis_thresholds = test_settings[testvar]['thresholds']
+        qc_varname = test_settings[testvar]['qc_varname']
+        attrs = test_settings[testvar]['attrs']
+
+        try:
+            ds[testvar]
+        except KeyError:
+            logging.debug('{:s} not found in file {:s})'.format(testvar, ncfile))
+            status = 1
+            continue
+
+        data_ind, flag_vals = flags[testvar]
+
+        if not data_ind.any():
+            logging.debug('{:s} data not found in file {:s})'.format(testvar, ncfile))
+            status = 1
+            continue
+
+        # if the pressure values are all nan or profile spans <5 dbar, don't run test
+        if pressure_ends is None:
+            # leave flag values as NOT_EVALUATED/UNKNOWN (2) and set the attributes
+            add_da(ds, flag_vals, attrs, testvar, qc_varname)
+            summary[testvar]['not_evaluated_profiles'] += 1
+            continue
+
+        # determine if first profile is up or down
+        if pressure_ends[0] > pressure_ends[1]:
+            # if profile is up, test can't be run because you need a down profile paired with an up profile
+            # leave flag values as NOT_EVALUATED/UNKNOWN (2) and set the attributes
+            add_da(ds, flag_vals, attrs, testvar, qc_varname)
+            summary[testvar]['not_evaluated_profiles'] += 1
+        else:  # first profile is down, check the next file
+            if next_file is None:
+                # if there are no more files, leave flag values on the first file as
+                # NOT_EVALUATED/UNKNOWN (2) and set the attributes
+                add_da(ds, flag_vals, attrs, testvar, qc_varname)
+
+                # add the hysteresis test to ancillary variable attribute
+                append_ancillary_variables(ds[testvar], qc_varname)
+
+                # add the hysteresis test to the salinity and density ancillary variable attribute
+                for v in ['salinity', 'density']:
+                    append_ancillary_variables(ds[v], qc_varname)
+
+                summary[testvar]['not_evaluated_profiles'] += 1
+                continue
+
+            if testvar not in next_testvars:
+                logging.debug('{:s} not found in file {:s})'.format(testvar, next_file))
+                status = 1
+                # TODO should we be checking the next file? example ru30_20210510T015902Z_sbd.nc
+                # leave flag values on the first file as NOT_EVALUATED/UNKNOWN (2) and set the attributes
+                add_da(ds, flag_vals, attrs, testvar, qc_varname)
+                summary[testvar]['not_evaluated_profiles'] += 1
+                continue
+
+            if ds2 is None:
+                # if second profile is also down (the second file isn't paired with the first file), test can't be
+                # run on the first file. Leave flag values on the first file as NOT_EVALUATED/UNKNOWN (2) and set the
+                # attributes
+                add_da(ds, flag_vals, attrs, testvar, qc_varname)
+                summary[testvar]['not_evaluated_profiles'] += 1
+            else:
+                data_ind2, flag_vals2 = flags2[testvar]
+
+                # if the pressure values are all nan or profile spans <5 dbar, don't run test
+                if np.logical_or(np.isnan(pressure_diff2), pressure_diff2 < 5):
+                    # leave flag values on the first file as NOT_EVALUATED/UNKNOWN (2) and set the attributes
+                    add_da(ds, flag_vals, attrs, testvar, qc_varname)
+                    add_da(ds2, flag_vals2, attrs, testvar, qc_varname)
+                    summary[testvar]['not_evaluated_profiles'] += 2
+                    continue
+
+                # first profile is down and second profile is up
+                # determine if the end/start timestamps are < 5 minutes apart,
+                # indicating a paired yo (down-up profile pair)
+                if ds2_time[0] - ds_time[-1] < np.timedelta64(5, 'm'):
+                #if ds2.time.values[0] - ds.time.values[-1] < np.timedelta64(5, 'm'):
+
+                    # make a copy of the data and apply QARTOD QC flags before testing for hysteresis
+                    data_copy = apply_qartod_qc(ds, testvar, qartod_vars[testvar])
+                    data_copy2 = apply_qartod_qc(ds2, testvar, qartod_vars2[testvar])
+
+                    # both yos must have data remaining after QARTOD flags are applied,
+                    # otherwise, test can't be run and leave the flag values as NOT_EVALUATED/UNKNOWN (2)
+                    if np.logical_and(np.sum(~np.isnan(data_copy)) > 0, np.sum(~np.isnan(data_copy2)) > 0):
+                        # combine the profiles and drop points with nan
+                        pair_data = np.concatenate([data_copy, data_copy2])
+                        non_nan = ~(np.isnan(pair_pressure) | np.isnan(pair_data))
+
+                        # determine the hysteresis flag for the profile pair
+                        flag = hysteresis_flag(pair_pressure[non_nan].astype(np.float64),
+                                               pair_data[non_nan].astype(np.float64),
+                                               hysteresis_thresholds)
+                        if flag == qartod.QartodFlags.FAIL:
+                            summary[testvar]['failed_profiles'] += 2
+                        elif flag == qartod.QartodFlags.SUSPECT:
+                            summary[testvar]['suspect_profiles'] += 2
+                        flag_vals[data_ind] = flag
+                        flag_vals2[data_ind2] = flag
+
+                        # add data array with hysteresis flag applied
+                        add_da(ds, flag_vals, attrs, testvar, qc_varname)
+                        add_da(ds2, flag_vals2, attrs, testvar, qc_varname)
+                    else:
+                        # if there is no data left after QARTOD tests are applied,
+                        # leave flag values NOT_EVALUATED/UNKNOWN (2)
+                        add_da(ds, flag_vals, attrs, testvar, qc_varname)
+                        add_da(ds2, flag_vals2, attrs, testvar, qc_varname)
+                        summary[testvar]['not_evaluated_profiles'] += 2
+                else:
+                    # if timestamps are too far apart they're likely not from the same profile pair
+                    # leave flag values as NOT_EVALUATED/UNKNOWN (2) and set the attributes
+                    add_da(ds, flag_vals, attrs, testvar, qc_varname)
+                    add_da(ds2, flag_vals2, attrs, testvar, qc_varname)
+                    summary[testvar]['not_evaluated_profiles'] += 2
+
+        # add the hysteresis test to ancillary variable attribute
+        append_ancillary_variables(ds[testvar], qc_varname)
+        if ds2 is not None and qc_varname in ds2:  # check that the qc variable is in the dataset
+            append_ancillary_variables(ds2[testvar], qc_varname)
+
+        # add the hysteresis test to the salinity and density ancillary variable attribute
+        for v in ['salinity', 'density']:
+            append_ancillary_variables(ds[v], qc_varname)
+            if ds2 is not None and qc_varname in ds2:  # check that the qc variable is in the dataset
+                append_ancillary_variables(ds2[v], qc_varname)
+
+    # update the history attr and save the dataset(s)
+    now = dt.datetime.now(dt.UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
+    if not hasattr(ds, 'history'):
+        ds.attrs['history'] = f'{now}: {os.path.basename(__file__)}'
+    else:
+        ds.attrs['history'] = f'{ds.attrs["history"]} {now}: {os.path.basename(__file__)}'
+
+    save_ds(ds, ncfile, test_varnames)
+
+    if ds2 is not None:
+        if not hasattr(ds2, 'history'):
+            ds2.attrs['history'] = f'{now}: {os.path.basename(__file__)}'
+        else:
+            ds2.attrs['history'] = f'{ds2.attrs["history"]} {now}: {os.path.basename(__file__)}'
+        save_ds(ds2, next_file, test_varnames)
+
+    return status, summary
+
+
 def set_hysteresis_attrs(test, sensor, thresholds=None):
     """
     Define the QC variable attributes for the CTD hysteresis test
@@ -186,7 +622,11 @@ def main(args):
             config_dict = loadconfig(config_file)
 
             # List the netcdf files
-            ncfiles = sorted(glob.glob(os.path.join(data_path, 'qc_queue', '*.nc')))
+            try:
+                with os.scandir(os.path.join(data_path, 'qc_queue')) as entries:
+                    ncfiles = sorted(e.path for e in entries if e.name.endswith('.nc') and e.is_file())
+            except FileNotFoundError:
+                ncfiles = []
 
             if len(ncfiles) == 0:
                 logging.error(' 0 files found to QC: {:s}'.format(os.path.join(data_path, 'qc_queue')))
@@ -195,6 +635,14 @@ def main(args):
 
             test_varnames = ['conductivity', 'temperature']
 
+            # the test thresholds, QC variable names and attributes are the same for every file in the deployment
+            test_settings = dict()
+            for tv in test_varnames:
+                qc_varname = f'{tv}_hysteresis_test'
+                test_settings[tv] = dict(thresholds=config_dict[qc_varname], qc_varname=qc_varname,
+                                         attrs=set_hysteresis_attrs(qc_varname, tv,
+                                                                    thresholds=config_dict[qc_varname]))
+
             # build the summary
             summary = dict()
             for tv in test_varnames:
@@ -203,264 +651,38 @@ def main(args):
                 summary[tv]['suspect_profiles'] = 0
                 summary[tv]['not_evaluated_profiles'] = 0
 
-            # Iterate through files
-            skip = 0
-            for i, f in enumerate(ncfiles):
-                # skip the files that have already been QC'd
-                try:
-                    if f2skip > 0:
-                        skip += 1
-                except UnboundLocalError:
-                    skip += 0
-
-                i += skip
-
-                # TODO end the code when all the files have been tested
-                if i >= len(ncfiles):
-                    continue
-
-                try:
-                    with xr.open_dataset(ncfiles[i], decode_times=False) as ds:
-                        ds = ds.load()
-                except OSError as e:
-                    logging.error('Error reading file {:s} ({:})'.format(ncfiles[i], e))
-                    status = 1
-                    continue
-                except IndexError:
-                    continue
-
-                f2skip = 0
-
-                # Iterate through the test variables
-                for testvar in test_varnames:
-                    # get the configuration thresholds
-                    hysteresis_thresholds = config_dict[f'{testvar}_hysteresis_test']
-
-                    try:
-                        ds[testvar]
-                    except KeyError:
-                        logging.debug('{:s} not found in file {:s})'.format(testvar, ncfiles[i]))
+            # Check the direction of each profile and pair the down profiles with the following up profiles, then run
+            # the test on the pairs. Each pair is tested and saved independently, so the files are processed in
+            # parallel. Log records from the worker processes are passed back to the deployment log file through a
+            # queue.
+            log_queue = multiprocessing.Queue()
+            listener = QueueListener(log_queue, *logging.handlers)
+            listener.start()
+            try:
+                with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=setup_queue_logger,
+                                         initargs=('logging', loglevel, log_queue)) as executor:
+                    # the pressure scan is quick for each file, so the files are sent to the workers in batches
+                    profiles = list(executor.map(partial(profile_info, test_varnames=test_varnames), ncfiles,
+                                                 chunksize=32))
+
+                    # files that can't be read are skipped
+                    if None in profiles:
                         status = 1
-                        continue
-
-                    qc_varname = f'{testvar}_hysteresis_test'
-                    kwargs = dict()
-                    kwargs['thresholds'] = hysteresis_thresholds
-                    attrs = set_hysteresis_attrs(qc_varname, testvar, **kwargs)
-                    data_idx, flag_vals = initialize_flags(ds, testvar)
-
-                    if len(data_idx) == 0:
-                        logging.debug('{:s} data not found in file {:s})'.format(testvar, ncfiles[i]))
-                        status = 1
-                        continue
-
-                    # apply qartod QC to pressure
-                    pressure_copy = apply_qartod_qc(ds, 'pressure')
-                    pressure_idx = np.where(np.invert(np.isnan(pressure_copy.values)))[0]
-
-                    # if the pressure values are all nan or profile spans <5 dbar, don't run test
-                    pressure_diff = np.nanmax(pressure_copy.values) - np.nanmin(pressure_copy.values)
-                    if np.logical_or(np.isnan(pressure_diff), pressure_diff < 5):
-                        # leave flag values as NOT_EVALUATED/UNKNOWN (2) and set the attributes
-                        add_da(ds, flag_vals, attrs, testvar, qc_varname)
-                        summary[testvar]['not_evaluated_profiles'] += 1
-                        continue
-
-                    # determine if first profile is up or down
-                    if pressure_copy.values[pressure_idx][0] > pressure_copy.values[pressure_idx][-1]:
-                        # if profile is up, test can't be run because you need a down profile paired with an up profile
-                        # leave flag values as NOT_EVALUATED/UNKNOWN (2) and set the attributes
-                        add_da(ds, flag_vals, attrs, testvar, qc_varname)
-                        summary[testvar]['not_evaluated_profiles'] += 1
-                    else:  # first profile is down, check the next file
-                        try:
-                            f2 = ncfiles[i + 1]
-                        except IndexError:
-                            # if there are no more files, leave flag values on the first file as
-                            # NOT_EVALUATED/UNKNOWN (2) and set the attributes
-                            add_da(ds, flag_vals, attrs, testvar, qc_varname)
-
-                            # add the hysteresis test to ancillary variable attribute
-                            append_ancillary_variables(ds[testvar], qc_varname)
-
-                            # add the hysteresis test to the salinity and density ancillary variable attribute
-                            for v in ['salinity', 'density']:
-                                append_ancillary_variables(ds[v], qc_varname)
-
-                            summary[testvar]['not_evaluated_profiles'] += 1
-                            continue
-
-                        try:
-                            # see if the second file is already open
-                            ds2
-                        except NameError:
-                            # if not, try to open the second file
-                            try:
-                                with xr.open_dataset(f2, decode_times=False) as ds2:
-                                    ds2 = ds2.load()
-                            except OSError as e:
-                                logging.error('Error reading file {:s} ({:})'.format(f2, e))
-                                status = 1
-                                f2skip += 1
-
-                        try:
-                            ds2[testvar]
-                        except KeyError:
-                            logging.debug('{:s} not found in file {:s})'.format(testvar, f2))
-                            status = 1
-                            # TODO should we be checking the next file? example ru30_20210510T015902Z_sbd.nc
-                            # leave flag values on the first file as NOT_EVALUATED/UNKNOWN (2) and set the attributes
-                            add_da(ds, flag_vals, attrs, testvar, qc_varname)
-                            summary[testvar]['not_evaluated_profiles'] += 1
-                            continue
-
-                        data_idx2, flag_vals2 = initialize_flags(ds2, testvar)
-
-                        # apply qartod QC to pressure
-                        pressure_copy2 = apply_qartod_qc(ds2, 'pressure')
-                        pressure_idx2 = np.where(np.invert(np.isnan(pressure_copy2.values)))[0]
-
-                        # if the pressure values are all nan or profile spans <5 dbar, don't run test
-                        pressure_diff2 = np.nanmax(pressure_copy2.values) - np.nanmin(pressure_copy2.values)
-                        if np.logical_or(np.isnan(pressure_diff2), pressure_diff2 < 5):
-                            # leave flag values on the first file as NOT_EVALUATED/UNKNOWN (2) and set the attributes
-                            add_da(ds, flag_vals, attrs, testvar, qc_varname)
-                            add_da(ds2, flag_vals2, attrs, testvar, qc_varname)
-                            summary[testvar]['not_evaluated_profiles'] += 2
-                            f2skip += 1
-                            continue
-
-                        # determine if second profile is up or down
-                        if pressure_copy2.values[pressure_idx2][0] < pressure_copy2.values[pressure_idx2][-1]:
-                            # if second profile is also down, test can't be run on the first file
-                            # leave flag values on the first file as NOT_EVALUATED/UNKNOWN (2) and set the attributes
-                            add_da(ds, flag_vals, attrs, testvar, qc_varname)
-                            summary[testvar]['not_evaluated_profiles'] += 1
-                        else:
-                            # first profile is down and second profile is up
-                            # determine if the end/start timestamps are < 5 minutes apart,
-                            # indicating a paired yo (down-up profile pair)
-                            ds_time = cf.convert_epoch_ts(ds['time'])
-                            ds2_time = cf.convert_epoch_ts(ds2['time'])
-                            if ds2_time[0] - ds_time[-1] < np.timedelta64(5, 'm'):
-                            #if ds2.time.values[0] - ds.time.values[-1] < np.timedelta64(5, 'm'):
-
-                                # make a copy of the data and apply QARTOD QC flags before testing for hysteresis
-                                data_copy = apply_qartod_qc(ds, testvar)
-                                data_copy2 = apply_qartod_qc(ds2, testvar)
-
-                                # both yos must have data remaining after QARTOD flags are applied,
-                                # otherwise, test can't be run and leave the flag values as NOT_EVALUATED/UNKNOWN (2)
-                                if np.logical_and(np.sum(~np.isnan(data_copy)) > 0, np.sum(~np.isnan(data_copy2)) > 0):
-                                    # calculate the area between the two profiles
-                                    # merge the QC'd data and QC'd pressure into dataframes
-                                    df = data_copy.to_dataframe().merge(pressure_copy.to_dataframe(), on='time')
-                                    df2 = data_copy2.to_dataframe().merge(pressure_copy2.to_dataframe(), on='time')
-
-                                    # interpolate pressure (in the case where pressure and sci data are offset)
-                                    df['pressure'] = df['pressure'].interpolate(method='linear', limit_direction='both',
-                                                                                limit=2).values
-
-                                    df2['pressure'] = df2['pressure'].interpolate(method='linear',
-                                                                                  limit_direction='both',
-                                                                                  limit=2).values
-
-                                    # combine dataframes and drop lines with nan
-                                    df = pd.concat([df, df2])  # df = df.append(df2)
-                                    df = df.dropna(subset=['pressure', testvar])
-
-                                    # calculate data ranges
-                                    pressure_range = np.nanmax(df.pressure) - np.nanmin(df.pressure)  # 'QCd pressure'
-                                    data_range = (np.nanmax(df[testvar].values) - np.nanmin(df[testvar].values))
-
-                                    # If the data range is >test_threshold, run the test.
-                                    if data_range > hysteresis_thresholds['test_threshold']:
-                                        polygon_points = df.values.tolist()
-                                        polygon_points.append(polygon_points[0])
-                                        polygon = Polygon(polygon_points)
-                                        polygon_lines = polygon.exterior
-                                        polygon_crossovers = polygon_lines.intersection(polygon_lines)
-                                        polygons = polygonize(polygon_crossovers)
-                                        valid_polygons = MultiPolygon(polygons)
-
-                                        # normalize area between the profiles to the pressure range
-                                        area = valid_polygons.area / pressure_range
-
-                                        # Flag failed profiles
-                                        if area > data_range * hysteresis_thresholds['fail_threshold']:
-                                            flag = qartod.QartodFlags.FAIL
-                                            summary[testvar]['failed_profiles'] += 2
-                                        # Flag suspect profiles
-                                        elif area > data_range * hysteresis_thresholds['suspect_threshold']:
-                                            flag = qartod.QartodFlags.SUSPECT
-                                            summary[testvar]['suspect_profiles'] += 2
-                                        # Otherwise, both profiles are good
-                                        else:
-                                            flag = qartod.QartodFlags.GOOD
-                                        flag_vals[data_idx] = flag
-                                        flag_vals2[data_idx2] = flag
-                                    else:
-                                        # if data range is < test_threshold, set flags to 1 (GOOD) since
-                                        # there will be no measureable hysteresis (usually in well-mixed water)
-                                        flag = qartod.QartodFlags.GOOD
-                                        flag_vals[data_idx] = flag
-                                        flag_vals2[data_idx2] = flag
-
-                                    # add data array with hysteresis flag applied
-                                    add_da(ds, flag_vals, attrs, testvar, qc_varname)
-                                    add_da(ds2, flag_vals2, attrs, testvar, qc_varname)
-                                    f2skip += 1
-
-                                else:
-                                    # if there is no data left after QARTOD tests are applied,
-                                    # leave flag values NOT_EVALUATED/UNKNOWN (2)
-                                    add_da(ds, flag_vals, attrs, testvar, qc_varname)
-                                    add_da(ds2, flag_vals2, attrs, testvar, qc_varname)
-                                    summary[testvar]['not_evaluated_profiles'] += 2
-                                    f2skip += 1
-                            else:
-                                # if timestamps are too far apart they're likely not from the same profile pair
-                                # leave flag values as NOT_EVALUATED/UNKNOWN (2) and set the attributes
-                                add_da(ds, flag_vals, attrs, testvar, qc_varname)
-                                add_da(ds2, flag_vals2, attrs, testvar, qc_varname)
-                                summary[testvar]['not_evaluated_profiles'] += 2
-                                f2skip += 1
-
-                    # add the hysteresis test to ancillary variable attribute
-                    append_ancillary_variables(ds[testvar], qc_varname)
-                    try:
-                        check = ds2[qc_varname]  # check that the qc variable is in the dataset
-                        append_ancillary_variables(ds2[testvar], qc_varname)
-                    except (KeyError, NameError):
-                        pass
-
-                    # add the hysteresis test to the salinity and density ancillary variable attribute
-                    for v in ['salinity', 'density']:
-                        append_ancillary_variables(ds[v], qc_varname)
-                        try:
-                            check = ds2[qc_varname]  # check that the qc variable is in the dataset
-                            append_ancillary_variables(ds2[v], qc_varname)
-                        except (KeyError, NameError):
-                            pass
-
-                # update the history attr and save the dataset(s)
-                now = dt.datetime.now(dt.UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
-                if not hasattr(ds, 'history'):
-                    ds.attrs['history'] = f'{now}: {os.path.basename(__file__)}'
-                else:
-                    ds.attrs['history'] = f'{ds.attrs["history"]} {now}: {os.path.basename(__file__)}'
-
-                ds.to_netcdf(ncfiles[i])
-                del ds
-                try:
-                    if not hasattr(ds2, 'history'):
-                        ds2.attrs['history'] = f'{now}: {os.path.basename(__file__)}'
-                    else:
-                        ds2.attrs['history'] = f'{ds2.attrs["history"]} {now}: {os.path.basename(__file__)}'
-                    ds2.to_netcdf(f2)
-                    del ds2
-                except NameError:
-                    pass
+                    pairs = find_profile_pairs(ncfiles, profiles)
+
+                    worker = partial(process_pair, test_settings=test_settings, test_varnames=test_varnames)
+                    results = list(executor.map(worker, *zip(*pairs))) if pairs else []
+            finally:
+                # stop the listener thread and close the log queue even if a worker raises an exception
+                listener.stop()
+                log_queue.close()
+                log_queue.join_thread()
+
+            for pair_status, pair_summary in results:
+                status = max(status, pair_status)
+                for tv in test_varnames:
+                    for key, count in pair_summary[tv].items():
+                        summary[tv][key] += count
 
             for tv in test_varnames:
                 tvs = summary[tv]
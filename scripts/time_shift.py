@@ -268,8 +268,8 @@ def main(args):
                     times = np.array([], dtype='datetime64[ns]')
 
                     # Iterate through profile files in each trajectory, define profile direction and append to df
-                    trajectory = pd.DataFrame()
-                    trajectory_all = pd.DataFrame()
+                    trajectory_dfs = []
+                    trajectory_all_dfs = []
                     for f in groupfiles:
                         try:
                             ds = xr.open_dataset(f, decode_times=False)
@@ -313,11 +313,15 @@ def main(args):
                         else:
                             # down cast
                             df['downs'] = 1
-                        trajectory = pd.concat([trajectory, df])  # trajectory = trajectory.append(df)
-                        trajectory_all = pd.concat([trajectory_all, df_all])  # trajectory_all = trajectory_all.append(df_all)
+                        trajectory_dfs.append(df)
+                        trajectory_all_dfs.append(df_all)
 
                         ds.close()
 
+                    # combine the profiles once, rather than copying the combined dataframe for every file
+                    trajectory = pd.concat(trajectory_dfs) if trajectory_dfs else pd.DataFrame()
+                    trajectory_all = pd.concat(trajectory_all_dfs) if trajectory_all_dfs else pd.DataFrame()
+
                     if len(times) == 0:
                         logging.debug('Variable not found in trajectory files: {}'.format(testvar))
                         shift_dict[testvar]['shift'] = None
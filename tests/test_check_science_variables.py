@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import netCDF4
+import numpy as np
+from netCDF4 import default_fillvals
+from scripts.check_science_variables import check_groups, process_file
+
+CTD_VARS = {'ctd_variables': {'conductivity': 'conductivity', 'temperature': 'temperature', 'salinity': 'salinity',
+                              'density': 'density'}}
+OXYGEN_VARS = {'oxygen_variables': {'oxygen_concentration': 'oxygen_concentration',
+                          'optode_water_temperature': 'optode_water_temperature'}}
+SCI_VARS = frozenset(['conductivity', 'temperature', 'oxygen_concentration'])
+
+
+def write_file(ncfile, variables):
+    # write a netcdf file with the variables along a time dimension. salinity has an explicit _FillValue, the other
+    # variables use the netCDF4 default fill value
+    with netCDF4.Dataset(ncfile, 'w') as nc:
+        nc.createDimension('time', 6)
+        nc.createVariable('time', 'f8', ('time',))[:] = np.arange(6)
+        for varname, values in variables.items():
+            fill_value = -999.0 if varname == 'salinity' else None
+            nc.createVariable(varname, 'f4', ('time',), fill_value=fill_value)[:] = values
+
+
+def read_file(ncfile):
+    with netCDF4.Dataset(ncfile) as nc:
+        nc.set_auto_mask(False)
+        return {varname: var[:] for varname, var in nc.variables.items()}
+
+
+def run_process_file(ncfile):
+    ctd_groups = check_groups(CTD_VARS, 'conductivity', 'temperature')
+    oxygen_groups = check_groups(OXYGEN_VARS, 'oxygen_concentration', 'optode_water_temperature')
+    return process_file(ncfile, ctd_groups, oxygen_groups, SCI_VARS)
+
+
+def test_zero_pairs_converted_to_fill_values(tmp_path):
+    ncfile = str(tmp_path / 'zeros.nc')
+    conductivity = [0.0, 4.1, 0.0, 4.2, 0.0, 4.3]
+    temperature = [0.0, 15.1, 15.2, 15.3, 0.0, 15.4]  # both are 0.0 at indices 0 and 4
+    salinity = [35.0, 35.1, 35.2, 35.3, 35.4, 35.5]
+    density = [1025.0, 1025.1, 1025.2, 1025.3, 1025.4, 1025.5]
+    oxygen = [0.0, 200.0, 0.0, 201.0, 0.0, 202.0]
+    write_file(ncfile, dict(conductivity=conductivity, temperature=temperature, salinity=salinity, density=density,
+                            oxygen_concentration=oxygen))
+
+    assert run_process_file(ncfile) == 'modified'
+
+    data = read_file(ncfile)
+    zeros = np.array([True, False, False, False, True, False])
+    f4_fill = np.float32(default_fillvals['f4'])
+    for varname, original, fill_value in [('conductivity', conductivity, f4_fill),
+                                          ('temperature', temperature, f4_fill),
+                                          ('salinity', salinity, np.float32(-999.0)),
+                                          ('density', density, f4_fill)]:
+        np.testing.assert_array_equal(data[varname], np.where(zeros, fill_value, np.float32(original)))
+
+    # oxygen isn't in the CTD group, and optode_water_temperature isn't in the file
+    np.testing.assert_array_equal(data['oxygen_concentration'], np.float32(oxygen))
+    np.testing.assert_array_equal(data['time'], np.arange(6))
+
+
+def test_file_without_science_variables(tmp_path):
+    ncfile = str(tmp_path / 'nosci.nc')
+    write_file(ncfile, dict(lat=np.zeros(6), lon=np.zeros(6)))
+    mtime = os.stat(ncfile).st_mtime_ns
+
+    assert run_process_file(ncfile) == 'nosci'
+
+    # the file is renamed by main, not process_file
+    assert os.path.isfile(ncfile)
+    assert os.stat(ncfile).st_mtime_ns == mtime
+    np.testing.assert_array_equal(read_file(ncfile)['lat'], np.zeros(6))
+
+
+def test_file_without_zero_pairs_is_not_rewritten(tmp_path):
+    ncfile = str(tmp_path / 'nozeros.nc')
+    conductivity = [0.0, 4.1, 4.2, 4.3, 4.4, 4.5]
+    temperature = [15.0, 15.1, 0.0, 15.3, 15.4, 15.5]
+    write_file(ncfile, dict(conductivity=conductivity, temperature=temperature))
+    mtime = os.stat(ncfile).st_mtime_ns
+
+    assert run_process_file(ncfile) is None
+
+    assert os.stat(ncfile).st_mtime_ns == mtime
+    data = read_file(ncfile)
+    np.testing.assert_array_equal(data['conductivity'], np.float32(conductivity))
+    np.testing.assert_array_equal(data['temperature'], np.float32(temperature))
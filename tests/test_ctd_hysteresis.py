@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import netCDF4
+import numpy as np
+import pytest
+from scripts.ctd_hysteresis_test import (find_profile_pairs, interpolate_gaps, process_pair, profile_info,
+                                         profile_pair_area, set_hysteresis_attrs)
+
+
+def test_crossover_at_shared_vertex():
+    # the down and up profiles cross at (10, 15), a point sampled by both profiles
+    x = np.array([0, 5, 10, 15, 20, 15, 10, 5, 0], dtype=float)
+    y = np.array([10, 13, 15, 16, 20, 18, 15, 12, 10], dtype=float)
+    assert profile_pair_area(x, y) == pytest.approx(15.0)
+
+
+def test_crossover_between_vertices():
+    # the down profile from (0, 0) to (4, 4) crosses the up profile from (4, 0) to (0, 4) at (2, 2), between
+    # sampled points: two triangles with a base of 4 and a height of 2
+    x = np.array([0, 4, 4, 0], dtype=float)
+    y = np.array([0, 4, 0, 4], dtype=float)
+    assert profile_pair_area(x, y) == pytest.approx(8.0)
+
+
+def test_figure_eight_unequal_lobes():
+    # the down profile y = x crosses the up profile y = 2 - x / 3 at (1.5, 1.5): the lobes are triangles with
+    # bases of 2 and 6 along x = 0 and x = 6, and heights of 1.5 and 4.5
+    x = np.array([0, 6, 6, 0], dtype=float)
+    y = np.array([0, 6, 0, 2], dtype=float)
+    assert profile_pair_area(x, y) == pytest.approx(1.5 + 13.5)
+
+
+def test_two_crossovers():
+    # the up profile crosses the down profile y = x at (1, 1) and (4.5, 4.5), giving three lobes of 0.5, 3.5
+    # and 1.5
+    x = np.array([0, 3, 6, 6, 3, 0], dtype=float)
+    y = np.array([0, 3, 6, 4, 5, -1], dtype=float)
+    assert profile_pair_area(x, y) == pytest.approx(0.5 + 3.5 + 1.5)
+
+
+def test_no_crossover():
+    # down and up profiles offset by 1 over a 10 dbar range
+    x = np.array([0, 10, 10, 0], dtype=float)
+    y = np.array([0, 0, 1, 1], dtype=float)
+    assert profile_pair_area(x, y) == pytest.approx(10.0)
+
+
+n = np.nan
+
+
+@pytest.mark.parametrize('values, expected', [
+    # leading gap longer than the limit, only the points within the limit of the first valid value are filled
+    ([n, n, n, n, 1, 2, 3], [n, n, 1, 1, 1, 2, 3]),
+    # trailing gap longer than the limit
+    ([1, 2, 3, n, n, n, n], [1, 2, 3, 3, 3, n, n]),
+    # interior gap longer than 2 * limit, the limit is filled from each side and the middle is left as nan
+    ([0, n, n, n, n, n, n, 7], [0, 1, 2, n, n, 5, 6, 7]),
+    # interior gap within 2 * limit is completely filled
+    ([0, n, n, n, 4], [0, 1, 2, 3, 4]),
+    # all nans
+    ([n, n, n], [n, n, n]),
+    # no nans
+    ([1, 2, 3], [1, 2, 3]),
+])
+def test_interpolate_gaps(values, expected):
+    np.testing.assert_array_equal(interpolate_gaps(np.array(values, dtype=float), limit=2),
+                                  np.array(expected, dtype=float))
+
+
+def info(pressure_ends, testvars=('conductivity', 'temperature'), has_pressure=True):
+    # profile_info dictionary for a file with data for all of the test variables
+    return dict(testvars=set(testvars), data_testvars=set(testvars), has_pressure=has_pressure,
+                pressure_ends=pressure_ends)
+
+
+def test_down_followed_by_up_is_paired():
+    pairs = find_profile_pairs(['down.nc', 'up.nc', 'down2.nc'],
+                               [info((0, 20)), info((20, 0)), info((0, 20))])
+    # the second file is tested with the first file, so the next pair starts at the third file
+    assert pairs == [('down.nc', (0, 20), 'up.nc', {'conductivity', 'temperature'}, True),
+                     ('down2.nc', (0, 20), None, None, False)]
+
+
+def test_down_followed_by_down_is_not_paired():
+    pairs = find_profile_pairs(['down.nc', 'down2.nc'], [info((0, 20)), info((0, 20))])
+    assert pairs == [('down.nc', (0, 20), 'down2.nc', {'conductivity', 'temperature'}, False),
+                     ('down2.nc', (0, 20), None, None, False)]
+
+
+def test_down_followed_by_flat_profile_is_paired():
+    # the flat profile spans <5 dbar, so it has no pressure ends
+    pairs = find_profile_pairs(['down.nc', 'flat.nc'], [info((0, 20)), info(None)])
+    assert pairs == [('down.nc', (0, 20), 'flat.nc', {'conductivity', 'temperature'}, True)]
+
+
+def test_second_file_without_pressure_is_not_paired():
+    pairs = find_profile_pairs(['down.nc', 'nopressure.nc'], [info((0, 20)), info(None, has_pressure=False)])
+    assert pairs == [('down.nc', (0, 20), 'nopressure.nc', {'conductivity', 'temperature'}, False),
+                     ('nopressure.nc', None, None, None, False)]
+
+
+def test_no_shared_test_variables_is_not_paired():
+    pairs = find_profile_pairs(['down.nc', 'up.nc'], [info((0, 20), testvars=['conductivity']),
+                                                      info((20, 0), testvars=['temperature'])])
+    assert pairs == [('down.nc', (0, 20), 'up.nc', {'temperature'}, False),
+                     ('up.nc', (20, 0), None, None, False)]
+
+
+def test_last_file_has_no_next_file():
+    pairs = find_profile_pairs(['up.nc', 'down.nc'], [info((20, 0)), info((0, 20))])
+    assert pairs[-1] == ('down.nc', (0, 20), None, None, False)
+    assert find_profile_pairs([], []) == []
+
+
+def test_unreadable_file_is_skipped():
+    # profile_info returns None for a file that can't be read, the files before and after it are paired instead
+    pairs = find_profile_pairs(['down.nc', 'bad.nc', 'up.nc'], [info((0, 20)), None, info((20, 0))])
+    assert pairs == [('down.nc', (0, 20), 'up.nc', {'conductivity', 'temperature'}, True)]
+
+
+def write_profile(ncfile, time, pressure, conductivity):
+    with netCDF4.Dataset(ncfile, 'w') as nc:
+        nc.createDimension('time', len(time))
+        nc.createVariable('time', 'f8', ('time',))[:] = time
+        nc.variables['time'].units = 'seconds since 1970-01-01T00:00:00Z'
+        for varname, values in dict(pressure=pressure, conductivity=conductivity).items():
+            nc.createVariable(varname, 'f4', ('time',))[:] = values
+        for varname in ['salinity', 'density']:
+            nc.createVariable(varname, 'f4', ('time',))[:] = np.full(len(time), 1.0)
+
+
+def test_down_and_flat_profiles_not_evaluated(tmp_path):
+    down = str(tmp_path / 'down.nc')
+    flat = str(tmp_path / 'flat.nc')
+    write_profile(down, [0, 60, 120, 180], [0, 5, 10, 20], [3.0, 3.5, 4.0, np.nan])
+    write_profile(flat, [240, 300, 360, 420], [20, 21, 22, 21], [np.nan, 4.0, 4.1, 4.2])
+
+    profiles = [profile_info(f, ['conductivity']) for f in [down, flat]]
+    pairs = find_profile_pairs([down, flat], profiles)
+    assert pairs == [(down, (0, 20), flat, {'conductivity'}, True)]
+
+    qc_varname = 'conductivity_hysteresis_test'
+    thresholds = dict(suspect_threshold=.1, fail_threshold=.2, test_threshold=.05)
+    test_settings = dict(conductivity=dict(thresholds=thresholds, qc_varname=qc_varname,
+                                           attrs=set_hysteresis_attrs(qc_varname, 'conductivity',
+                                                                      thresholds=thresholds)))
+    status, summary = process_pair(*pairs[0], test_settings=test_settings, test_varnames=['conductivity'])
+
+    assert status == 0
+    assert summary['conductivity'] == dict(failed_profiles=0, suspect_profiles=0, not_evaluated_profiles=2)
+
+    # both files are NOT_EVALUATED (2) where there is data and MISSING (9) where there isn't
+    for ncfile, expected in [(down, [2, 2, 2, 9]), (flat, [9, 2, 2, 2])]:
+        with netCDF4.Dataset(ncfile) as nc:
+            np.testing.assert_array_equal(nc.variables[qc_varname][:], expected)